@@ -5,73 +5,220 @@ Preserves 5-hour rate limit reset boundaries by sending minimal prompts when nee
 """
 import os
 import sys
+import asyncio
 import subprocess
 import json
+import time
 import argparse
+import atexit
+import uuid
+import hashlib
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, Dict
-from curl_cffi import requests
+from typing import Optional, Dict, TextIO, Tuple
+from curl_cffi.requests import AsyncSession
 
 SCRIPT_DIR = Path(__file__).parent
 CONFIG_PATH = SCRIPT_DIR / "config.json"
+CACHE_PATH = SCRIPT_DIR / ".usage_cache.json"
+
+_BASE_HEADERS = {
+    "Accept": "*/*",
+    "Content-Type": "application/json",
+}
+
+_LOG_FH: Optional[TextIO] = None
 
 
 def load_config() -> Dict:
-    """Load configuration from config.json."""
+    """Load configuration from config.json.
+
+    User paths are expanded once up front, and accounts that can never succeed
+    are logged and dropped so they cost no network calls.
+    """
     with open(CONFIG_PATH) as f:
-        return json.load(f)
+        config = json.load(f)
+
+    log_file = config.get("log_file")
+    if log_file:
+        log_file = config["log_file"] = os.path.expanduser(log_file)
+    use_claude_cli = config.get("use_claude_cli", False)
+
+    valid_accounts = []
+    for account in config.get("accounts", []):
+        name = account.get("name", "?")
+        if account.get("config_dir"):
+            account["config_dir"] = os.path.expanduser(account["config_dir"])
+
+        if not account.get("org_id") or not account.get("session_key"):
+            log(f"[{name}] Missing org_id or session_key - skipping", log_file)
+        elif use_claude_cli and not (account.get("config_dir") and os.path.isdir(account["config_dir"])):
+            log(f"[{name}] Config directory missing: {account.get('config_dir')} - skipping", log_file)
+        else:
+            valid_accounts.append(account)
+
+    config["accounts"] = valid_accounts
+    return config
+
+
+def _get_log_fh(log_file: str) -> TextIO:
+    """Open the log file on first use and keep it open for the rest of the run."""
+    global _LOG_FH
+    if _LOG_FH is None:
+        log_path = Path(log_file).expanduser()
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        _LOG_FH = open(log_path, "a", buffering=1)
+        atexit.register(_LOG_FH.close)
+    return _LOG_FH
 
 
 def log(message: str, log_file: Optional[str]) -> None:
     """Write log message if logging is enabled."""
     if log_file:
-        timestamp = datetime.now(timezone.utc).isoformat()
-        log_path = Path(log_file).expanduser()
-        log_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(log_path, "a") as f:
-            f.write(f"{timestamp} - {message}\n")
+        now = time.time()
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + f".{int(now % 1 * 1e6):06d}+00:00"
+        _get_log_fh(log_file).write(f"{timestamp} - {message}\n")
 
 
-def fetch_usage(org_id: str, session_key: str, log_file: Optional[str], test_mode: bool = False, account_name: str = "") -> Optional[Dict]:
-    """Fetch usage data from Claude API with retry logic for network issues."""
-    import time
+def usage_cache_key(org_id: str, session_key: str) -> str:
+    """Build the usage cache key for one user in an org.
+
+    Usage is per user, so the key includes a hash of the session key rather
+    than the key itself, which keeps the secret out of the cache file.
+    """
+    return f"{org_id}:{hashlib.sha256(session_key.encode()).hexdigest()[:16]}"
 
-    url = f"https://claude.ai/api/organizations/{org_id}/usage"
 
-    headers = {
-        "Accept": "*/*",
-        "Content-Type": "application/json",
-        "Cookie": f"sessionKey={session_key}",
+def load_usage_cache() -> Dict:
+    """Load cached usage responses keyed by usage_cache_key.
+
+    A missing or unreadable file yields an empty cache, and entries that
+    aren't shaped like those written by save_usage_cache are dropped.
+    """
+    try:
+        with open(CACHE_PATH) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(cache, dict):
+        return {}
+    return {
+        key: entry
+        for key, entry in cache.items()
+        if isinstance(entry, dict)
+        and isinstance(entry.get("data"), dict)
+        and isinstance(entry.get("fetched_at"), str)
+    }
+
+
+def save_usage_cache(key: str, data: Dict) -> None:
+    """Store a usage response under key, replacing the cache file atomically."""
+    cache = load_usage_cache()
+    cache[key] = {
+        "data": data,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
     }
+    tmp_path = CACHE_PATH.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(cache))
+    tmp_path.replace(CACHE_PATH)
+
+
+def parse_reset(resets_at: Optional[str]) -> Optional[datetime]:
+    """Parse a resets_at timestamp, returning None if missing or malformed.
+
+    Timestamps without an offset are treated as UTC so they compare safely
+    against timezone-aware datetimes.
+    """
+    if not resets_at:
+        return None
+    try:
+        reset = datetime.fromisoformat(resets_at)
+    except (TypeError, ValueError):
+        return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=timezone.utc)
+    return reset
+
+
+def boundaries_active(usage: Dict, keepalive_modes: list) -> bool:
+    """Return True if every mode has a reset boundary that is still in the future."""
+    now = datetime.now(timezone.utc)
+    for mode in keepalive_modes:
+        mode_data = usage.get(mode) or {}
+        reset = parse_reset(mode_data.get("resets_at"))
+        if not reset or reset <= now:
+            return False
+    return True
+
+
+async def fetch_usage(session: AsyncSession, org_id: str, session_key: str, log_file: Optional[str], test_mode: bool = False, account_name: str = "") -> Optional[Dict]:
+    """Fetch usage data from Claude API with retry logic for network issues.
+
+    Successful responses are written to the usage cache, and the last cached
+    response is returned as a fallback if every fetch attempt fails (except in
+    test mode).
+    """
+    cache_key = usage_cache_key(org_id, session_key)
+    cached = load_usage_cache().get(cache_key)
+
+    url = f"https://claude.ai/api/organizations/{org_id}/usage"
+
+    headers = {**_BASE_HEADERS, "Cookie": f"sessionKey={session_key}"}
 
     max_retries = 3
     for attempt in range(max_retries):
         try:
             log(f"[{account_name}] Fetch attempt {attempt + 1}/{max_retries} - calling {url}", log_file)
-            response = requests.get(
-                url,
-                headers=headers,
-                timeout=10,
-                impersonate="chrome110",
-            )
+            response = await session.get(url, headers=headers, timeout=10)
             response.raise_for_status()
             data = response.json()
 
             log(f"[{account_name}] ✓ Fetch successful (HTTP {response.status_code}, attempt {attempt + 1}/{max_retries})", log_file)
             if test_mode:
                 log(f"[{account_name}] ✓ API credentials valid (HTTP {response.status_code})", log_file)
-
-            return data
+            break
         except Exception as e:
             if attempt < max_retries - 1:
                 wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s
                 log(f"[{account_name}] ✗ Fetch attempt {attempt + 1}/{max_retries} failed, retrying in {wait_time}s: {e}", log_file)
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
             else:
                 log(f"[{account_name}] ✗ Failed to fetch usage after {max_retries} attempts: {e}", log_file)
+                # Test mode must surface credential failures, so no stale fallback there
+                if cached and not test_mode:
+                    log(f"[{account_name}] Falling back to stale cached usage (fetched {cached['fetched_at']})", log_file)
+                    return cached["data"]
                 return None
 
+    try:
+        save_usage_cache(cache_key, data)
+    except OSError as e:
+        log(f"[{account_name}] ✗ Failed to write usage cache: {e}", log_file)
+    return data
+
+
+def fetch_usage_once(usage_fetches: Dict[Tuple[str, str], "asyncio.Task[Optional[Dict]]"], session: AsyncSession, org_id: str, session_key: str, log_file: Optional[str], test_mode: bool = False, account_name: str = "") -> "asyncio.Task[Optional[Dict]]":
+    """Fetch usage for an org_id/session_key pair at most once per run.
+
+    Usage is per user, so only accounts with the same org_id and session_key
+    await the same task and coalesce onto a single in-flight request. Test
+    mode never shares, so every account's credentials are checked. The shared
+    fetch never answers from the disk cache, since whether a cached response
+    is still usable depends on each account's keepalive_modes.
+    """
+    key = (org_id, session_key)
+    if key in usage_fetches and not test_mode:
+        log(f"[{account_name}] Sharing usage fetch for org {org_id}", log_file)
+        return usage_fetches[key]
+
+    task = asyncio.create_task(
+        fetch_usage(session, org_id, session_key, log_file, test_mode=test_mode, account_name=account_name)
+    )
+    if not test_mode:
+        usage_fetches[key] = task
+    return task
+
 
 def should_send_keepalive(usage: Dict, account_name: str, log_file: Optional[str], keepalive_modes: list, force: bool = False) -> bool:
     """Determine if keepalive prompt should be sent based on configured modes."""
@@ -87,39 +234,112 @@ def should_send_keepalive(usage: Dict, account_name: str, log_file: Optional[str
         elif not resets_at:
             log(f"[{account_name}] No {mode} reset boundary - needs keepalive", log_file)
             needs_keepalive = True
+        elif (reset := parse_reset(resets_at)) and reset <= datetime.now(timezone.utc):
+            log(f"[{account_name}] {mode} reset boundary expired at {resets_at} - needs keepalive", log_file)
+            needs_keepalive = True
         else:
             log(f"[{account_name}] {mode} reset boundary exists: {resets_at}", log_file)
 
     return needs_keepalive
 
 
-def send_prompt(config_dir: Path, claude_bin: str, model: str, prompt: str, log_file: Optional[str]) -> bool:
-    """Send minimal prompt to one account."""
-    env = os.environ.copy()
-    env["CLAUDE_CONFIG_DIR"] = str(config_dir)
+def stream_error(body: str) -> Optional[str]:
+    """Return the data of the first error event in a server-sent event stream, if any."""
+    event = None
+    for line in body.splitlines():
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:") and event == "error":
+            return line[len("data:"):].strip()
+        elif not line:
+            event = None
+    return None
+
+
+async def send_prompt_api(session: AsyncSession, org_id: str, session_key: str, model: str, prompt: str, log_file: Optional[str], account_name: str = "") -> bool:
+    """Send minimal prompt to one account through the claude.ai API.
+
+    The prompt goes into a throwaway conversation that is deleted afterwards so
+    keepalives don't pile up in the account's chat history.
+    """
+    base_url = f"https://claude.ai/api/organizations/{org_id}/chat_conversations"
+    conversation_id = str(uuid.uuid4())
+
+    headers = {**_BASE_HEADERS, "Cookie": f"sessionKey={session_key}"}
+
+    log(f"[{account_name}] Sending prompt via API - model={model}, conversation={conversation_id}", log_file)
+
+    created = False
+    try:
+        response = await session.post(
+            base_url,
+            headers=headers,
+            json={"uuid": conversation_id, "name": ""},
+            timeout=10,
+        )
+        response.raise_for_status()
+        created = True
+
+        response = await session.post(
+            f"{base_url}/{conversation_id}/completion",
+            headers={**headers, "Accept": "text/event-stream"},
+            json={
+                "prompt": prompt,
+                "model": model,
+                "timezone": "UTC",
+                "attachments": [],
+                "files": [],
+            },
+            timeout=30,
+        )
+        response.raise_for_status()
+
+        error = stream_error(response.text)
+        if error is not None:
+            log(f"[{account_name}] ✗ Completion stream returned an error: {error[:200]}", log_file)
+            return False
+
+        log(f"[{account_name}] ✓ Sent prompt successfully (HTTP {response.status_code})", log_file)
+        return True
+    except Exception as e:
+        log(f"[{account_name}] ✗ Error: {e}", log_file)
+        return False
+    finally:
+        if created:
+            try:
+                response = await session.delete(f"{base_url}/{conversation_id}", headers=headers, timeout=10)
+                response.raise_for_status()
+            except Exception as e:
+                log(f"[{account_name}] ✗ Failed to delete keepalive conversation {conversation_id}: {e}", log_file)
+
+
+async def send_prompt(config_dir: Path, claude_bin: str, model: str, prompt: str, log_file: Optional[str], base_env: Dict[str, str]) -> bool:
+    """Send minimal prompt to one account through the claude CLI."""
+    env = base_env | {"CLAUDE_CONFIG_DIR": str(config_dir)}
 
     cmd = [claude_bin, "-p", prompt, "--model", model]
     log(f"[{config_dir.name}] Sending prompt - cmd={' '.join(cmd)}, config_dir={config_dir}", log_file)
 
     try:
-        result = subprocess.run(
-            cmd,
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
             env=env,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             stdin=subprocess.DEVNULL,
-            timeout=30,
-            check=False,
         )
-        success = result.returncode == 0
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=30)
+        success = proc.returncode == 0
         if not success:
-            stderr_preview = result.stderr.decode('utf-8', errors='ignore')[:200] if result.stderr else ""
-            log(f"[{config_dir.name}] ✗ Failed with code {result.returncode}: {stderr_preview}", log_file)
+            stderr_preview = stderr.decode('utf-8', errors='ignore')[:200] if stderr else ""
+            log(f"[{config_dir.name}] ✗ Failed with code {proc.returncode}: {stderr_preview}", log_file)
         else:
-            stdout_preview = result.stdout.decode('utf-8', errors='ignore')[:100] if result.stdout else ""
+            stdout_preview = stdout.decode('utf-8', errors='ignore')[:100] if stdout else ""
             log(f"[{config_dir.name}] ✓ Sent prompt successfully: {stdout_preview}", log_file)
         return success
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
         log(f"[{config_dir.name}] ✗ Timeout after 30s", log_file)
         return False
     except Exception as e:
@@ -127,45 +347,84 @@ def send_prompt(config_dir: Path, claude_bin: str, model: str, prompt: str, log_
         return False
 
 
-def process_account(account: Dict, config: Dict, test_mode: bool = False) -> None:
+async def process_account(session: AsyncSession, account: Dict, config: Dict, base_env: Dict[str, str], usage_fetches: Dict[Tuple[str, str], "asyncio.Task[Optional[Dict]]"], test_mode: bool = False) -> None:
     """Process a single account."""
-    name = account["name"]
-    config_dir = Path(account["config_dir"]).expanduser()
+    name = account.get("name", "?")
+    config_dir = account.get("config_dir")
     org_id = account["org_id"]
     session_key = account["session_key"]
     keepalive_modes = account.get("keepalive_modes", ["five_hour"])
     log_file = config.get("log_file")
 
-    if not org_id or not session_key:
-        log(f"[{name}] Missing org_id or session_key", log_file)
-        return
-
-    if not config_dir.exists():
-        log(f"[{name}] Config directory missing: {config_dir}", log_file)
-        return
-
     log(f"[{name}] Checking modes: {keepalive_modes}", log_file)
 
-    usage = fetch_usage(org_id, session_key, log_file, test_mode=test_mode, account_name=name)
+    usage = await fetch_usage_once(usage_fetches, session, org_id, session_key, log_file, test_mode=test_mode, account_name=name)
     if not usage:
         return
 
     if not should_send_keepalive(usage, name, log_file, keepalive_modes, force=test_mode):
         return
 
-    send_prompt(
-        config_dir,
-        config.get("claude_bin", "/usr/local/bin/claude"),
-        config.get("model", "claude-haiku-4-5"),
-        config.get("prompt", "hi"),
-        log_file,
-    )
+    model = config.get("model", "claude-haiku-4-5")
+    prompt = config.get("prompt", "hi")
+    if config.get("use_claude_cli", False):
+        await send_prompt(
+            Path(config_dir),
+            config.get("claude_bin", "/usr/local/bin/claude"),
+            model,
+            prompt,
+            log_file,
+            base_env,
+        )
+    else:
+        await send_prompt_api(session, org_id, session_key, model, prompt, log_file, account_name=name)
+
+
+async def process_accounts(config: Dict, test_mode: bool = False) -> None:
+    """Process all accounts concurrently over one shared HTTP session."""
+    base_env = dict(os.environ)
+    usage_fetches: Dict[Tuple[str, str], asyncio.Task[Optional[Dict]]] = {}
+    log_file = config.get("log_file")
+    accounts = config.get("accounts", [])
+
+    # Skip accounts whose cached reset boundaries are all still in the future.
+    # This is the only place a cache hit avoids a usage fetch.
+    if not test_mode:
+        usage_cache = load_usage_cache()
+        active_accounts = []
+        for account in accounts:
+            name = account.get("name", "?")
+            try:
+                cached = usage_cache.get(usage_cache_key(account["org_id"], account["session_key"]))
+                skip = bool(cached) and boundaries_active(cached["data"], account.get("keepalive_modes", ["five_hour"]))
+            except Exception as e:
+                # A bad cache entry must not abort the run; fall through to a normal fetch
+                log(f"[{name}] ✗ Could not check cached usage, fetching instead: {e!r}", log_file)
+                skip = False
+
+            if skip:
+                log(f"[{name}] Cached reset boundaries still active - skipping", log_file)
+            else:
+                active_accounts.append(account)
+        accounts = active_accounts
+
+    async with AsyncSession(impersonate="chrome110") as session:
+        results = await asyncio.gather(
+            *[
+                process_account(session, account, config, base_env, usage_fetches, test_mode=test_mode)
+                for account in accounts
+            ],
+            return_exceptions=True,
+        )
+
+    # Surface per-account failures without letting one account abort the others
+    for account, result in zip(accounts, results):
+        if isinstance(result, Exception):
+            log(f"[{account.get('name', '?')}] ✗ Unexpected error: {result!r}", log_file)
 
 
 def main() -> None:
     """Main execution flow."""
-    import time
-
     parser = argparse.ArgumentParser(
         description="Claude Code keepalive automation"
     )
@@ -192,8 +451,7 @@ def main() -> None:
     mode = "test mode" if args.test else "normal mode"
     log(f"Starting keepalive check ({mode})", log_file)
 
-    for account in config.get("accounts", []):
-        process_account(account, config, test_mode=args.test)
+    asyncio.run(process_accounts(config, test_mode=args.test))
 
     log("Keepalive complete", log_file)
 
@@ -6,6 +6,7 @@ Schedules 24 wake events at :55 for the next 24 hours to ensure Mac is awake whe
 import subprocess
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import List
 
 LOG_FILE = Path("~/logs/claude_keepalive.log").expanduser()
 
@@ -41,22 +42,33 @@ def clear_existing_wakes() -> bool:
         return False
 
 
-def schedule_wake_event(wake_time: datetime) -> bool:
-    """Schedule a single wake event at the specified time."""
+def schedule_wake_events(wake_times: List[datetime]) -> int:
+    """Schedule wake events at the specified times, returning the number that succeeded.
+
+    pmset accepts one event per invocation, so all invocations are started
+    together and then collected rather than run one after another.
+    """
     # Format: MM/DD/YY HH:MM:SS
-    time_str = wake_time.strftime("%m/%d/%y %H:%M:%S")
+    time_strs = [wake_time.strftime("%m/%d/%y %H:%M:%S") for wake_time in wake_times]
 
-    try:
-        subprocess.run(
+    procs = [
+        subprocess.Popen(
             ["sudo", "pmset", "schedule", "wake", time_str],
-            check=True,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             text=True,
         )
-        return True
-    except subprocess.CalledProcessError as e:
-        log(f"✗ Failed to schedule wake at {time_str}: {e.stderr}")
-        return False
+        for time_str in time_strs
+    ]
+
+    scheduled_count = 0
+    for time_str, proc in zip(time_strs, procs):
+        _, stderr = proc.communicate()
+        if proc.returncode == 0:
+            scheduled_count += 1
+        else:
+            log(f"✗ Failed to schedule wake at {time_str}: {stderr}")
+    return scheduled_count
 
 
 def schedule_24_hours() -> None:
@@ -75,17 +87,11 @@ def schedule_24_hours() -> None:
     if now.minute >= 55:
         current_hour += timedelta(hours=1)
 
-    scheduled_count = 0
-    failed_count = 0
-
     log(f"Scheduling 24 wake events starting from {current_hour.strftime('%m/%d/%y %H:%M:%S')}")
 
-    for i in range(24):
-        wake_time = current_hour + timedelta(hours=i)
-        if schedule_wake_event(wake_time):
-            scheduled_count += 1
-        else:
-            failed_count += 1
+    wake_times = [current_hour + timedelta(hours=i) for i in range(24)]
+    scheduled_count = schedule_wake_events(wake_times)
+    failed_count = len(wake_times) - scheduled_count
 
     log(f"✓ Scheduled {scheduled_count} wake events")
     if failed_count > 0: